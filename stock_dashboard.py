@@ -4,32 +4,89 @@ import pandas as pd
 import datetime
 import pytz
 import os
+import re
+import string
+import sys
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 from dateutil import parser
 from gnews import GNews
+import httpx
+from selectolax.lexbor import LexborHTMLParser
 from streamlit_gsheets import GSheetsConnection
 
+try:
+    from pybloom_live import ScalableBloomFilter
+except ImportError:
+    ScalableBloomFilter = None
+
 # Constants
 TZ_SHANGHAI = pytz.timezone('Asia/Shanghai')
+TZ_NEW_YORK = pytz.timezone('America/New_York')  # FinViz shows US/Eastern dates and times
+FETCH_TIMEOUT = 15  # Seconds to wait on slow news sources before giving up
+MAX_FETCH_WORKERS = 32
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+NEWS_CACHE_TTL = 600  # Seconds
+LATEST_NEWS_LIMIT = 5  # Articles shown under "All Latest News"
+FINVIZ_DATE_FORMAT = '%b-%d-%y %I:%M%p'  # e.g. 'Dec-10-24 09:30AM'
+FINVIZ_QUOTE_URL = 'https://finviz.com/quote.ashx'
+HTTP_TIMEOUT = 10.0  # Seconds
+# FinViz rejects requests without a browser-like User-Agent
+HTTP_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'}
+
+SHINGLE_WIDTH = 13  # Characters per title shingle for near-duplicate detection
+DUPLICATE_SHINGLE_RATIO = 0.8  # Share of shingles shared with one earlier title that marks a duplicate
 
 # --- Helper Functions ---
 
 def load_watchlist_df():
-    """Loads all watchlist data from Google Sheets."""
+    """Loads all watchlist data from Google Sheets, once per session."""
+    if 'watchlist_df' in st.session_state:
+        return st.session_state['watchlist_df']
     try:
         conn = st.connection("gsheets", type=GSheetsConnection)
         df = conn.read(worksheet="watchlist", ttl=0)
         if df.empty:
-            return pd.DataFrame(columns=['List_Name', 'Ticker', 'Note'])
+            df = pd.DataFrame(columns=['List_Name', 'Ticker', 'Note'])
+        st.session_state['watchlist_df'] = df
         return df
     except Exception as e:
         st.error(f"Error loading watchlist from GSheets: {e}")
         return pd.DataFrame(columns=['List_Name', 'Ticker', 'Note'])
 
+def load_watchlists():
+    """Returns the watchlists as a plain {list name: [tickers]} mapping, once per session."""
+    if 'watchlists' in st.session_state:
+        return st.session_state['watchlists']
+    df = load_watchlist_df()
+    watchlists = {}
+    if 'List_Name' in df.columns and 'Ticker' in df.columns:
+        for list_name, ticker in zip(df['List_Name'].tolist(), df['Ticker'].tolist()):
+            if pd.isna(list_name) or pd.isna(ticker):
+                continue
+            tickers = watchlists.setdefault(list_name, [])
+            if ticker not in tickers:
+                tickers.append(ticker)
+    # Only keep the mapping if the sheet read succeeded, so failures are retried
+    if 'watchlist_df' in st.session_state:
+        st.session_state['watchlists'] = watchlists
+    return watchlists
+
 def add_stock_to_list(list_name, ticker, note=""):
     """Adds a stock to a specific watchlist in GSheets."""
+    df = load_watchlist_df()
+    # Never overwrite the sheet from an empty placeholder after a failed read
+    if 'watchlist_df' not in st.session_state:
+        st.error("Watchlist could not be loaded from GSheets; not saving.")
+        return
     try:
         conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="watchlist", ttl=0)
         
         new_row = {
             'List_Name': list_name,
@@ -50,115 +107,386 @@ def add_stock_to_list(list_name, ticker, note=""):
             updated_df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
             
         conn.update(worksheet="watchlist", data=updated_df)
-        st.cache_data.clear()
+        st.session_state['watchlist_df'] = updated_df
+        st.session_state.pop('watchlists', None)
         st.toast(f"Added {ticker} to {list_name}")
         
     except Exception as e:
         st.error(f"Error saving to watchlist: {e}")
 
+@st.cache_resource
+def get_http_client():
+    """
+    Returns the process-wide HTTP/2 client, so connections (and TLS handshakes)
+    are reused across tickers, threads and reruns.
+    yfinance already keeps its own shared session, so only our direct scrapes go through this.
+    """
+    return httpx.Client(
+        http2=True,
+        timeout=HTTP_TIMEOUT,
+        headers=HTTP_HEADERS,
+        follow_redirects=True,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+
+@st.cache_resource
+def get_ticker(symbol):
+    """Returns a shared yfinance Ticker object for the symbol (for history(), which always refetches)."""
+    return yf.Ticker(symbol)
+
+def summarize_price_history(hist):
+    """Computes current price and daily change from a price history frame."""
+    if hist.empty:
+        return None
+    # Plain array indexing; Series.iloc overhead dominates on a 5-row history
+    closes = hist['Close'].to_numpy()
+    current_price = float(closes[-1])
+    previous_close = float(closes[-2]) if closes.shape[0] > 1 else current_price
+    price_change = current_price - previous_close
+    # Bad yfinance data can report a zero close; plain floats would raise here
+    percent_change = (price_change / previous_close) * 100 if previous_close else float('nan')
+    return {
+        "current_price": current_price,
+        "change": price_change,
+        "pct_change": percent_change
+    }
+
+# Called from worker threads, which can't draw a spinner; main() shows one instead
+@st.cache_data(ttl=300, show_spinner=False)
 def get_stock_price_data(ticker):
     """Fetches just the price data using yfinance."""
-    stock = yf.Ticker(ticker)
+    stock = get_ticker(ticker)
     try:
         hist = stock.history(period="5d")
-        if hist.empty:
-            return None
-        current_price = hist['Close'].iloc[-1]
-        previous_close = hist['Close'].iloc[-2] if len(hist) > 1 else current_price
-        price_change = current_price - previous_close
-        percent_change = (price_change / previous_close) * 100
-        return {
-            "current_price": current_price,
-            "change": price_change,
-            "pct_change": percent_change
-        }
+        return summarize_price_history(hist)
     except Exception:
         return None
 
-def load_bookmarks():
-    """Loads bookmarks from Google Sheets."""
+@st.cache_data(ttl=300)
+def get_prices_batch(tickers):
+    """Fetches price data for several tickers in a single yfinance download."""
+    prices = {}
+    if not tickers:
+        return prices
+    try:
+        data = yf.download(
+            tickers=" ".join(tickers),
+            period="5d",
+            group_by="ticker",
+            threads=True,
+            progress=False,
+            auto_adjust=False
+        )
+    except Exception as e:
+        print(f"Batch price download error: {e}")
+        return prices
+
+    if data.empty:
+        return prices
+
+    for ticker in tickers:
+        try:
+            # Older yfinance returns flat columns for a single ticker
+            if isinstance(data.columns, pd.MultiIndex):
+                hist = data[ticker]
+            else:
+                hist = data
+            prices[ticker] = summarize_price_history(hist.dropna(subset=['Close']))
+        except KeyError:
+            continue
+    return prices
+
+def load_bookmarks_df():
+    """Loads the bookmark sheet once per session; the session copy is the source of truth after that."""
+    if 'bookmarks_df' in st.session_state:
+        return st.session_state['bookmarks_df']
     try:
         conn = st.connection("gsheets", type=GSheetsConnection)
         df = conn.read(worksheet="stock_bookmarks", ttl=0)
-        if df.empty:
-            return []
-        return df.to_dict('records')
+        st.session_state['bookmarks_df'] = df
+        return df
     except Exception as e:
         # If credentials are missing locally, this might fail.
         # Check if secrets file exists first or handle gracefully.
         print(f"Error loading bookmarks from GSheets: {e}")
-        return []
+        return pd.DataFrame()
+
+def load_bookmarks():
+    """Returns bookmarks grouped as {ticker: [records]}."""
+    if 'bookmarks_by_ticker' in st.session_state:
+        return st.session_state['bookmarks_by_ticker']
+    df = load_bookmarks_df()
+    if df.empty or 'Ticker' not in df.columns:
+        bookmarks_by_ticker = {}
+    else:
+        bookmarks_by_ticker = {ticker: group.to_dict('records') for ticker, group in df.groupby('Ticker', sort=False, dropna=False)}
+    if 'bookmarks_df' in st.session_state:
+        st.session_state['bookmarks_by_ticker'] = bookmarks_by_ticker
+    return bookmarks_by_ticker
+
+def get_pending_bookmark_ops():
+    """Returns this session's queue of unsynced bookmark changes."""
+    if 'pending_bookmark_ops' not in st.session_state:
+        st.session_state['pending_bookmark_ops'] = []
+    return st.session_state['pending_bookmark_ops']
+
+def reduce_bookmark_ops(ops):
+    """Collapses queued ops into (bookmarks to add by URL, URLs to remove)."""
+    adds = {}
+    removed = set()
+    for op, value in ops:
+        if op == 'add':
+            adds[value['URL']] = value
+            removed.discard(value['URL'])
+        elif op == 'remove':
+            adds.pop(value, None)
+            removed.add(value)
+    return adds, removed
+
+def apply_pending_bookmark_ops(bookmarks_by_ticker):
+    """Overlays unsynced changes on bookmarks grouped by ticker."""
+    adds, removed = reduce_bookmark_ops(get_pending_bookmark_ops())
+    if not adds and not removed:
+        return bookmarks_by_ticker
+
+    merged = {}
+    seen_urls = set()
+    for ticker, items in bookmarks_by_ticker.items():
+        kept = [b for b in items if b.get('URL') not in removed]
+        if kept:
+            merged[ticker] = kept
+            seen_urls.update(b.get('URL') for b in kept)
+    for url, b in adds.items():
+        if url not in seen_urls:
+            merged.setdefault(b['Ticker'], []).append(b)
+    return merged
 
 def save_bookmark(article, ticker, category):
-    """Saves a news article to bookmarks in Google Sheets."""
+    """Queues a news article to be saved to bookmarks in Google Sheets."""
+    bookmarks_by_ticker = apply_pending_bookmark_ops(load_bookmarks())
+    seen_urls = {b.get('URL') for items in bookmarks_by_ticker.values() for b in items}
+    if article['link'] in seen_urls:
+        st.toast(f"Already saved: {article['title'][:30]}...")
+        return
+
+    new_bookmark = {
+        'Timestamp': datetime.datetime.now().isoformat(),
+        'Ticker': ticker,
+        'Category': category,
+        'Title': article['title'],
+        'URL': article['link'],
+        'Source': article['source']
+    }
+    get_pending_bookmark_ops().append(('add', new_bookmark))
+    st.toast(f"Queued: {article['title'][:30]}... (click Sync Bookmarks to save)")
+
+def remove_bookmark(url):
+    """Queues a bookmark for removal by URL."""
+    get_pending_bookmark_ops().append(('remove', url))
+    st.toast("Removal queued (click Sync Bookmarks to save).")
+
+def sync_bookmarks():
+    """Writes all queued bookmark changes to Google Sheets in one update."""
+    ops = get_pending_bookmark_ops()
+    if not ops:
+        return
+    df = load_bookmarks_df()
+    # Never overwrite the sheet from an empty placeholder after a failed read
+    if 'bookmarks_df' not in st.session_state:
+        st.error("Bookmarks could not be loaded from GSheets; not syncing.")
+        return
     try:
         conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="stock_bookmarks", ttl=0)
-        
-        # Deduplication check by URL
+        adds, removed = reduce_bookmark_ops(ops)
+
         # GSheets read returns a DF, if empty or first time, might be issue if no columns.
-        # But assuming sheet exists with columns or we handle it.
-        
-        if not df.empty and 'URL' in df.columns:
-            if article['link'] in df['URL'].values:
-                st.toast(f"Already saved: {article['title'][:30]}...")
-                return
+        if 'URL' in df.columns:
+            if removed:
+                df = df[~df['URL'].isin(removed)]
+            seen_urls = set(df['URL'].tolist())
+        else:
+            seen_urls = set()
 
-        new_bookmark = {
-            'Timestamp': datetime.datetime.now().isoformat(),
-            'Ticker': ticker,
-            'Category': category,
-            'Title': article['title'],
-            'URL': article['link'],
-            'Source': article['source']
-        }
-        
-        # Append logic
-        if df.empty:
-            # Create new DF
-            updated_df = pd.DataFrame([new_bookmark])
+        new_rows = [b for url, b in adds.items() if url not in seen_urls]
+        if not new_rows:
+            updated_df = df
+        elif df.empty:
+            updated_df = pd.DataFrame(new_rows)
         else:
-            new_row = pd.DataFrame([new_bookmark])
-            updated_df = pd.concat([df, new_row], ignore_index=True)
-            
+            updated_df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
+
+        # The session copy is authoritative, so write without re-reading the sheet
         conn.update(worksheet="stock_bookmarks", data=updated_df)
-        st.cache_data.clear() # Clear cache to refresh read
-        st.toast(f"Saved: {article['title'][:30]}...")
-        
+        ops.clear()
+        st.session_state['bookmarks_df'] = updated_df
+        st.session_state.pop('bookmarks_by_ticker', None)
+        st.toast("Bookmarks synced.")
     except Exception as e:
-        st.error(f"Error saving bookmark to GSheets: {e}")
+        st.error(f"Error syncing bookmarks to GSheets: {e}")
 
-def remove_bookmark(url):
-    """Removes a bookmark by URL from Google Sheets."""
-    try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="stock_bookmarks", ttl=0)
-        
-        if df.empty or 'URL' not in df.columns:
+
+# --- News Cache ---
+
+class FileCache:
+    """Small JSON file cache stored as <root>/<source>/<ticker>.json."""
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+
+    def _path(self, source, ticker):
+        safe_ticker = str(ticker).upper().replace('/', '_')
+        return os.path.join(self.root, source, f"{safe_ticker}.json")
+
+    def get(self, source, ticker, ttl):
+        """Returns cached articles, or None if missing, stale or unreadable."""
+        path = self._path(source, ticker)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - payload.get('ts', 0) > ttl:
+            return None
+        articles = payload.get('data', [])
+        for article in articles:
+            article['published_at'] = parser.isoparse(article['published_at'])
+        return articles
+
+    def set(self, source, ticker, articles):
+        path = self._path(source, ticker)
+        data = [dict(a, published_at=a['published_at'].isoformat()) for a in articles]
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a unique temp file first so concurrent readers never see a partial file
+            # (Streamlit sessions are threads in one process, so a per-pid name would collide)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump({'ts': time.time(), 'data': data}, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            print(f"News cache write error for {source}/{ticker}: {e}")
+
+    def clear(self, ticker=None):
+        """Removes cached entries for one ticker, or the whole cache."""
+        if ticker is None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            return
+        if not os.path.isdir(self.root):
             return
+        for source in os.listdir(self.root):
+            try:
+                os.remove(self._path(source, ticker))
+            except OSError:
+                pass
+
+news_cache = FileCache()
+
+def cached_fetch(source, ticker, fn, ttl=NEWS_CACHE_TTL):
+    """Returns fn(ticker), served from the on-disk cache when fresh."""
+    articles = news_cache.get(source, ticker, ttl)
+    if articles is None:
+        articles = fn(ticker)
+        # Don't cache failures; fetchers return [] on error
+        if articles:
+            news_cache.set(source, ticker, articles)
+    return articles
 
-        # Filter out the URL
-        updated_df = df[df['URL'] != url]
-        
-        conn.update(worksheet="stock_bookmarks", data=updated_df)
-        st.cache_data.clear()
-        st.toast("Article removed.")
-    except Exception as e:
-        st.error(f"Error removing bookmark from GSheets: {e}")
+def cache_clear(ticker=None):
+    """Clears cached news for a ticker (or everything). Debugging hook."""
+    news_cache.clear(ticker)
 
 
 # --- News Fetching Functions ---
 
+_NORM_TABLE = str.maketrans({c: None for c in string.punctuation})
+_WHITESPACE_RE = re.compile(r"\s+")
+
 def normalize_title(title):
-    """Simple normalization for deduplication."""
+    """Normalization for deduplication: drops punctuation, case and extra whitespace."""
     if not title:
         return ""
-    return str(title).lower().strip()
+    return _WHITESPACE_RE.sub(" ", str(title).translate(_NORM_TABLE)).lower().strip()
+
+def link_uid(link):
+    """Returns a short stable hash of an article link."""
+    return hashlib.blake2b(str(link).encode(), digest_size=6).hexdigest()
+
+def title_shingles(norm_title):
+    """Splits a normalized title into overlapping fixed-width shingles."""
+    return [norm_title[i:i + SHINGLE_WIDTH] for i in range(len(norm_title) - SHINGLE_WIDTH + 1)]
+
+class TitleDeduper:
+    """
+    Flags exact and near-duplicate titles by how many of their shingles one earlier title shares.
+
+    Filing titles (8-K, 10-Q, ...) are templated, so they only dedupe on an exact match:
+
+    >>> deduper = TitleDeduper()
+    >>> deduper.is_duplicate("Form 8-K Apple Inc. For: Oct 10")
+    False
+    >>> deduper.is_duplicate("Form 8-K Apple Inc. For: Oct 12")
+    False
+    >>> deduper.is_duplicate("Form 8-K Apple Inc. For: Oct 10")
+    True
+    """
+
+    def __init__(self):
+        self.seen_titles = set()
+        self.title_shingle_sets = []
+        self.min_shingle_count = 0
+        if ScalableBloomFilter is not None:
+            self.shingles = ScalableBloomFilter(initial_capacity=1024, error_rate=1e-4)
+        else:
+            # pybloom_live not installed; a set gives the same answers with more memory
+            self.shingles = set()
+
+    def _is_near_duplicate(self, shingles):
+        if not self.title_shingle_sets:
+            return False
+        shingle_set = set(shingles)
+        # The pooled Bloom check is an upper bound on the overlap with any single
+        # earlier title, so most titles are cleared without the per-title scan
+        seen = sum(1 for sh in shingle_set if sh in self.shingles)
+        smallest = min(len(shingle_set), self.min_shingle_count)
+        if seen / smallest <= DUPLICATE_SHINGLE_RATIO:
+            return False
+        # Relative to the shorter title, so a headline with a publisher suffix still matches
+        return any(
+            len(shingle_set & earlier) / min(len(shingle_set), len(earlier)) > DUPLICATE_SHINGLE_RATIO
+            for earlier in self.title_shingle_sets
+        )
+
+    def is_duplicate(self, title):
+        """Returns True if the title was already seen; otherwise records it."""
+        norm_title = normalize_title(title)
+        if norm_title in self.seen_titles:
+            return True
+
+        shingles = title_shingles(norm_title)
+        # Titles shorter than one shingle, and templated filing titles, only use the exact check above
+        if shingles and not _ANN_KW_RE.search(str(title)):
+            if self._is_near_duplicate(shingles):
+                return True
+
+        self.seen_titles.add(norm_title)
+        if shingles:
+            shingle_set = set(shingles)
+            if not self.title_shingle_sets or len(shingle_set) < self.min_shingle_count:
+                self.min_shingle_count = len(shingle_set)
+            self.title_shingle_sets.append(shingle_set)
+            for sh in shingle_set:
+                self.shingles.add(sh)
+        return False
 
 def fetch_yfinance_news(ticker):
     """Fetches news from Yahoo Finance."""
     articles = []
     try:
+        # Fresh Ticker: yfinance memoizes .news on the object, so the shared one would never refresh
         stock = yf.Ticker(ticker)
         news = stock.news
         for item in news:
@@ -187,12 +515,14 @@ def fetch_gnews(ticker):
         google_news = GNews(max_results=3)
         g_news = google_news.get_news(f"{ticker} stock news")
         for item in g_news:
-            # GNews dates are strings, need parsing
+            # GNews dates are RFC 2822 strings, e.g. 'Tue, 10 Dec 2024 14:30:00 GMT'
             try:
-                dt = parser.parse(item.get('published date'))
-                # Ensure timezone aware
+                dt = parsedate_to_datetime(item.get('published date'))
+                # Ensure timezone aware, normalized to UTC
                 if dt.tzinfo is None:
                     dt = dt.replace(tzinfo=datetime.timezone.utc)
+                else:
+                    dt = dt.astimezone(datetime.timezone.utc)
             except:
                 dt = datetime.datetime.now(datetime.timezone.utc)
             
@@ -207,70 +537,131 @@ def fetch_gnews(ticker):
          print(f"GNews error for {ticker}: {e}")
     return articles
 
+def parse_finviz_date(date_str):
+    """Parses a FinViz (US/Eastern) timestamp to UTC, trying the known format before dateutil."""
+    try:
+        dt = datetime.datetime.strptime(date_str, FINVIZ_DATE_FORMAT)
+    except (TypeError, ValueError):
+        dt = parser.parse(date_str)
+    if dt.tzinfo is None:
+        dt = TZ_NEW_YORK.localize(dt)
+    return dt.astimezone(datetime.timezone.utc)
+
 def fetch_finviz_news(ticker):
-    """Fetches news from FinViz."""
+    """Fetches news from the FinViz quote page."""
     articles = []
     try:
-        fv = finvizfinance(ticker)
-        news_df = fv.ticker_news()
-        # Returns a dataframe with 'Date', 'Title', 'Link'
-        # Date is string like 'Dec-10-24 09:30AM'
-        
-        # Limit to top 5 recent
-        for index, row in news_df.head(5).iterrows():
-            date_str = row['Date']
+        resp = get_http_client().get(FINVIZ_QUOTE_URL, params={'t': ticker, 'p': 'd'})
+        resp.raise_for_status()
+        tree = LexborHTMLParser(resp.text)
+
+        # Each row has a date cell like 'Dec-10-24 09:30AM'; later rows on
+        # the same day only show the time, so carry the last date forward
+        last_date = None
+        for row in tree.css('table.fullview-news-outer tr'):
+            link = row.css_first('a.tab-link-news')
+            date_cell = row.css_first('td')
+            if link is None or date_cell is None:
+                continue
+
+            parts = date_cell.text(strip=True).split()
+            if len(parts) > 1:
+                last_date = parts[0]
+                if last_date == 'Today':
+                    last_date = datetime.datetime.now(TZ_NEW_YORK).strftime('%b-%d-%y')
             try:
-                # FinViz date format handling
-                dt = parser.parse(date_str)
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=datetime.timezone.utc) # Approx, strict TZ parsing might fail
+                dt = parse_finviz_date(f"{last_date} {parts[-1]}")
             except:
                 dt = datetime.datetime.now(datetime.timezone.utc)
 
             articles.append({
-                'title': row['Title'],
-                'link': row['Link'],
+                'title': link.text(separator=' ', strip=True),
+                'link': urljoin(FINVIZ_QUOTE_URL, link.attributes.get('href', '')),
                 'publisher': 'FinViz',
                 'published_at': dt,
                 'source': 'FinViz'
             })
+
+            # Limit to top 5 recent
+            if len(articles) >= 5:
+                break
     except Exception as e:
         print(f"FinViz error for {ticker}: {e}")
     return articles
 
-def get_aggregated_news(ticker):
-    """Fetches news from all sources, dedupes, and filters by 24h."""
-    all_news = []
+def get_aggregated_news(ticker, latest_limit=LATEST_NEWS_LIMIT):
+    """
+    Fetches news from all sources, dedupes, and filters by 24h.
+    Returns (all articles from the last 24h, the latest `latest_limit` articles of any age,
+    whether every source answered before FETCH_TIMEOUT).
+    """
+    complete = True
+    # Filter last 24h up front, so sort + dedup mostly run on articles we keep
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=24)
+    recent_pool = []
+    older_pool = []
     
-    # Fetch in parallel could be better but keeping it simple/sequential for reliability
-    all_news.extend(fetch_yfinance_news(ticker))
-    all_news.extend(fetch_gnews(ticker))
-    all_news.extend(fetch_finviz_news(ticker))
+    # Fetch all sources in parallel; a slow source is dropped after FETCH_TIMEOUT
+    fetchers = {
+        'yahoo': fetch_yfinance_news,
+        'gnews': fetch_gnews,
+        'finviz': fetch_finviz_news,
+    }
+    executor = ThreadPoolExecutor(max_workers=len(fetchers))
+    futures = {
+        executor.submit(cached_fetch, source, ticker, fn): source
+        for source, fn in fetchers.items()
+    }
+    try:
+        for future in as_completed(futures, timeout=FETCH_TIMEOUT):
+            for article in future.result():
+                if article['published_at'] >= cutoff:
+                    recent_pool.append(article)
+                else:
+                    older_pool.append(article)
+    except FuturesTimeout:
+        complete = False
+        pending = [name for f, name in futures.items() if not f.done()]
+        print(f"News fetch timed out for {ticker}: {', '.join(pending)}")
+    finally:
+        # Don't block the page on stragglers
+        executor.shutdown(wait=False, cancel_futures=True)
     
     # Deduplication
-    seen_titles = set()
-    unique_news = []
+    deduper = TitleDeduper()
     
-    # Sort by date first to keep the newest version of a duplicate? 
-    # Or just keep the first one found?
-    # Let's sort all by date descending
-    all_news.sort(key=lambda x: x['published_at'], reverse=True)
+    def dedupe(articles, limit=None):
+        # Sort by date descending so the newest version of a duplicate is kept
+        articles.sort(key=lambda x: x['published_at'], reverse=True)
+        unique = []
+        for article in articles:
+            if limit is not None and len(unique) >= limit:
+                break
+            # Catches near-duplicates too, e.g. the same headline with a suffix from another publisher
+            if not deduper.is_duplicate(article['title']):
+                # Short stable id for widget keys, instead of the full URL
+                article['_uid'] = link_uid(article['link'])
+                unique.append(article)
+        return unique
     
-    for article in all_news:
-        norm_title = normalize_title(article['title'])
-        # Simple fuzzy match or startswith could be better, but exact match of normalized title is safe
-        if norm_title not in seen_titles:
-            seen_titles.add(norm_title)
-            unique_news.append(article)
-            
-    # Filter last 24h
-    recent_news = []
-    now = datetime.datetime.now(datetime.timezone.utc)
-    for article in unique_news:
-        if (now - article['published_at']) < datetime.timedelta(hours=24):
-            recent_news.append(article)
+    recent_news = dedupe(recent_pool)
+    
+    # Older articles are only needed to top up the latest list
+    latest_news = recent_news[:latest_limit]
+    if len(latest_news) < latest_limit:
+        latest_news += dedupe(older_pool, latest_limit - len(latest_news))
             
-    return recent_news, unique_news
+    return recent_news, latest_news, complete
+
+# Announcement classification rules, compiled once
+ANNOUNCEMENT_PUBLISHERS = (
+    "PR Newswire", "Business Wire", "GlobeNewswire", "Accesswire", "SEC.gov"
+)
+ANNOUNCEMENT_KEYWORDS = (
+    "8-K", "10-Q", "10-K", "Form 4", "Schedule 13G"
+)
+_ANN_PUB_RE = re.compile("|".join(map(re.escape, ANNOUNCEMENT_PUBLISHERS)), re.IGNORECASE)
+_ANN_KW_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, ANNOUNCEMENT_KEYWORDS)) + r")\b", re.IGNORECASE)
 
 def classify_news(article):
     """
@@ -279,30 +670,66 @@ def classify_news(article):
     1. Publisher in {PR Newswire, Business Wire, GlobeNewswire, Accesswire, SEC.gov}
     2. Title contains {8-K, 10-Q, 10-K, Form 4, Schedule 13G}
     """
-    announcement_publishers = {
-        "PR Newswire", "Business Wire", "GlobeNewswire", "Accesswire", "SEC.gov"
-    }
-    announcement_keywords = {
-        "8-K", "10-Q", "10-K", "Form 4", "Schedule 13G"
-    }
-
-    publisher = str(article.get('publisher', '')).strip()
-    title = str(article.get('title', '')).strip()
-
     # Rule 1: Publisher check
-    # Check if any part of the publisher string matches our set (sometimes "PR Newswire via Yahoo")
-    if any(pub.lower() in publisher.lower() for pub in announcement_publishers):
+    # Substring match, since publishers can look like "PR Newswire via Yahoo"
+    if _ANN_PUB_RE.search(str(article.get('publisher', ''))):
         return "Announcements"
         
     # Rule 2: Title check
-    if any(kw.lower() in title.lower() for kw in announcement_keywords):
+    if _ANN_KW_RE.search(str(article.get('title', ''))):
         return "Announcements"
         
     return "Media News"
 
 
+# Short TTL: the on-disk news cache already holds articles for NEWS_CACHE_TTL,
+# this one only saves rebuilding panels on click-driven reruns.
+# Called from worker threads, which can't draw a spinner; main() shows one instead
+@st.cache_data(ttl=60, show_spinner=False)
+def build_ticker_panel(ticker):
+    """Fetches and classifies the latest news for one ticker."""
+    recent_news, all_news_items, complete = get_aggregated_news(ticker)
+
+    announcements = []
+    media_news = []
+    for news in recent_news:
+        category = classify_news(news)
+        if category == "Announcements":
+            announcements.append(news)
+        else:
+            media_news.append(news)
+
+    return {
+        'ticker': ticker,
+        'announcements': announcements,
+        'media_news': media_news,
+        'all': all_news_items,
+        'complete': complete
+    }
+
+
 # --- Main App ---
 
+# Color code source
+SOURCE_COLORS = {'Yahoo': 'violet', 'FinViz': 'orange'}
+
+def render_news_list(news_items, ticker, category, key_prefix):
+    """Renders articles as one markdown block, with Save buttons built only while the popover is open."""
+    md = "\n".join(
+        f"- :{SOURCE_COLORS.get(n['source'], 'blue')}[[{n['source']}]] [{n['title']}]({n['link']}) - *{n['publisher']}*"
+        for n in news_items
+    )
+    st.markdown(md)
+
+    # Popover contents run on every rerun by default; only build the buttons when it is open
+    pop = st.popover("⭐ Save", key=f"{key_prefix}_pop_{ticker}", on_change="rerun")
+    if pop.open:
+        with pop:
+            for news in news_items:
+                if st.button(news['title'], key=f"{key_prefix}_{ticker}_{news['_uid']}"):
+                    save_bookmark(news, ticker, category)
+                    st.rerun()
+
 def main():
     st.set_page_config(page_title="US Stock Briefing", layout="wide")
 
@@ -311,12 +738,10 @@ def main():
     st.sidebar.header("Manage Watchlist")
     
     # Load all data
-    watchlist_df = load_watchlist_df()
+    watchlists = load_watchlists()
     
     # 1. Feature: Watchlist Selector
-    all_lists = []
-    if not watchlist_df.empty and 'List_Name' in watchlist_df.columns:
-        all_lists = sorted(watchlist_df['List_Name'].unique().tolist())
+    all_lists = sorted(watchlists)
     
     selected_list = st.sidebar.selectbox("📂 Select Watchlist", ["Select..."] + all_lists)
     
@@ -350,11 +775,8 @@ def main():
 
     # Filter tickers for main dashboard
     current_tickers = []
-    if selected_list != "Select..." and not watchlist_df.empty:
-        # Filter DF
-        active_df = watchlist_df[watchlist_df['List_Name'] == selected_list]
-        if 'Ticker' in active_df.columns:
-            current_tickers = active_df['Ticker'].dropna().unique().tolist()
+    if selected_list != "Select...":
+        current_tickers = watchlists.get(selected_list, [])
             
     # Helper for delete (optional but good for cleanup) - keeping it simple for now as requested
     # Just show list stats
@@ -366,21 +788,21 @@ def main():
     st.sidebar.divider()
     st.sidebar.subheader("📂 Saved Articles")
     
-    bookmarks = load_bookmarks()
-    if bookmarks:
-        # Group by Ticker for better display
-        bookmarks_by_ticker = {}
-        for b in bookmarks:
-            t = b['Ticker']
-            if t not in bookmarks_by_ticker:
-                bookmarks_by_ticker[t] = []
-            bookmarks_by_ticker[t].append(b)
-        
+    pending_ops = get_pending_bookmark_ops()
+    if pending_ops:
+        st.sidebar.caption(f"{len(pending_ops)} unsynced change(s)")
+        if st.sidebar.button("☁️ Sync Bookmarks"):
+            sync_bookmarks()
+            st.rerun()
+
+    # Grouped by Ticker for better display
+    bookmarks_by_ticker = apply_pending_bookmark_ops(load_bookmarks())
+    if bookmarks_by_ticker:
         for ticker, items in bookmarks_by_ticker.items():
             with st.sidebar.expander(f"{ticker} ({len(items)})"):
                 for i, item in enumerate(items):
                     st.sidebar.markdown(f"[{item['Title']}]({item['URL']})")
-                    if st.sidebar.button("🗑️ Remove", key=f"del_{i}_{item['URL']}"):
+                    if st.sidebar.button("🗑️ Remove", key=f"del_{i}_{link_uid(item['URL'])}"):
                         remove_bookmark(item['URL'])
                         st.rerun()
     else:
@@ -401,38 +823,47 @@ def main():
     # Check for new dependencies
     try:
         import gnews
-        import finvizfinance
+        import selectolax
     except ImportError:
-        st.error("Missing libraries: `gnews` or `finvizfinance`. Please install them.")
+        st.error("Missing libraries: `gnews` or `selectolax`. Please install them.")
         return
 
     st.header(f"📰 Daily Briefing: {selected_list}")
     
+    if st.button("🔄 Refresh News"):
+        build_ticker_panel.clear()
+        for ticker in current_tickers:
+            cache_clear(ticker)
+        st.rerun()
+    
     # Combined Data Loading
     with st.spinner('Fetching aggregated news from Yahoo, Google, and FinViz...'):
-        dashboard_data = [] # List of (ticker, price_data, recent_news, all_news)
+        dashboard_data = [] # List of ticker panels with price data
         
-        for ticker in current_tickers:
-            price_data = get_stock_price_data(ticker)
-            recent_news, all_news_items = get_aggregated_news(ticker)
-            
-            # Classify news
-            announcements = []
-            media_news = []
-            for news in recent_news:
-                category = classify_news(news)
-                if category == "Announcements":
-                    announcements.append(news)
-                else:
-                    media_news.append(news)
+        prices = get_prices_batch(tuple(current_tickers))
+        
+        def load_ticker(ticker):
+            price_data = prices.get(ticker)
+            if price_data is None:
+                # Fall back to a single-ticker lookup if the batch missed it
+                price_data = get_stock_price_data(ticker)
+            panel = build_ticker_panel(ticker)
+            if not panel['complete']:
+                # A source timed out; don't keep serving the partial panel to every session
+                build_ticker_panel.clear(ticker)
+            panel['price'] = price_data
+            return panel
+        
+        workers = min(MAX_FETCH_WORKERS, 4 * len(current_tickers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(load_ticker, ticker) for ticker in current_tickers]
             
-            dashboard_data.append({
-                'ticker': ticker,
-                'price': price_data,
-                'announcements': announcements,
-                'media_news': media_news,
-                'all': all_news_items
-            })
+            for future in as_completed(futures):
+                dashboard_data.append(future.result())
+        
+        # Completion order is arbitrary; keep the watchlist order for display
+        order = {ticker: i for i, ticker in enumerate(current_tickers)}
+        dashboard_data.sort(key=lambda item: order[item['ticker']])
 
     # Briefing Section
     recent_found = False
@@ -451,37 +882,13 @@ def main():
                 
                 with tab1:
                     if item['announcements']:
-                        for news in item['announcements']:
-                            # Color code source
-                            source_color = "blue"
-                            if news['source'] == 'Yahoo': source_color = "violet"
-                            elif news['source'] == 'FinViz': source_color = "orange"
-                            
-                            col1, col2 = st.columns([0.85, 0.15])
-                            with col1:
-                                st.markdown(f":{source_color}[[{news['source']}]] [{news['title']}]({news['link']}) - *{news['publisher']}*")
-                            with col2:
-                                if st.button("⭐ Save", key=f"save_ann_{item['ticker']}_{news['link']}"):
-                                    save_bookmark(news, item['ticker'], "Announcement")
-                                    st.rerun()
+                        render_news_list(item['announcements'], item['ticker'], "Announcement", "save_ann")
                     else:
                         st.caption("No official announcements in the last 24h.")
                 
                 with tab2:
                     if item['media_news']:
-                        for news in item['media_news']:
-                            # Color code source
-                            source_color = "blue"
-                            if news['source'] == 'Yahoo': source_color = "violet"
-                            elif news['source'] == 'FinViz': source_color = "orange"
-                            
-                            col1, col2 = st.columns([0.85, 0.15])
-                            with col1:
-                                st.markdown(f":{source_color}[[{news['source']}]] [{news['title']}]({news['link']}) - *{news['publisher']}*")
-                            with col2:
-                                if st.button("⭐ Save", key=f"save_med_{item['ticker']}_{news['link']}"):
-                                    save_bookmark(news, item['ticker'], "Media News")
-                                    st.rerun()
+                        render_news_list(item['media_news'], item['ticker'], "Media News", "save_med")
                     else:
                         st.caption("No media news in the last 24h.")
 
@@ -507,8 +914,13 @@ def main():
                 st.metric(label=ticker, value="N/A", delta="Error")
             
             with st.expander("All Latest News"):
-                for news in item['all'][:5]:
+                for news in item['all']:
                     st.markdown(f"**[{news['source']}]** [{news['title']}]({news['link']})")
 
 if __name__ == "__main__":
-    main()
+    # Debugging: `python stock_dashboard.py --clear-cache [TICKER]`
+    if len(sys.argv) > 1 and sys.argv[1] == "--clear-cache":
+        cache_clear(sys.argv[2] if len(sys.argv) > 2 else None)
+        print("News cache cleared.")
+    else:
+        main()